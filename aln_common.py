@@ -0,0 +1,66 @@
+"""
+Shared helpers for the ALN Memory Scanner scripts
+Imported by sync.py, generate-qr.py, convert-arduino-assets.py and
+create_placeholders.py (run them from the repository root)
+"""
+
+import json
+import marshal
+import os
+from PIL import Image
+
+# Optional faster JSON parser; falls back to the standard library
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Fixed QR mask pattern: any of the eight masks gives a valid code, and
+# scoring all of them dominates encode time for these short IDs
+QR_MASK_PATTERN = 0
+
+# Copy of the last tokens.json parsed, reused while the file is unchanged.
+# Kept in the user's cache directory, outside any checkout, and stored with
+# marshal, which only decodes plain data and never runs code
+TOKENS_CACHE = os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+    'aln-memory-scanner', 'tokens_cache.marshal',
+)
+
+
+def load_cached_tokens(path):
+    """Load a tokens.json file, skipping the JSON parse if it hasn't changed"""
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+    try:
+        with open(TOKENS_CACHE, 'rb') as f:
+            if marshal.load(f) == key:
+                return marshal.load(f)
+    except Exception:
+        # Missing, truncated or otherwise unreadable cache - parse the JSON
+        pass
+
+    with open(path, 'rb') as f:
+        data = f.read()
+    tokens = orjson.loads(data) if orjson else json.loads(data)
+    try:
+        os.makedirs(os.path.dirname(TOKENS_CACHE), exist_ok=True)
+        with open(TOKENS_CACHE, 'wb') as f:
+            marshal.dump(key, f)
+            marshal.dump(tokens, f)
+    except (OSError, ValueError):
+        # Unwritable cache dir, or data marshal can't store - just skip it
+        pass
+    return tokens
+
+
+def render_qr(qr):
+    """Render a made QR code as a 1-bit image (dark modules = 0)"""
+    # One pixel per module (border included), then a NEAREST upscale by
+    # box_size - same pixels as qrcode's make_image, without its Python loop
+    modules = qr.get_matrix()
+    size = len(modules)
+    pixels = bytes(0 if dark else 255 for row in modules for dark in row)
+    img = Image.frombytes('L', (size, size), pixels)
+    img = img.resize((size * qr.box_size, size * qr.box_size), Image.Resampling.NEAREST)
+    return img.convert('1', dither=Image.Dither.NONE)
@@ -7,258 +7,429 @@ Works with any token ID in tokens.json
 
 import os
 import json
-from PIL import Image
-
-print("=" * 60)
-print("🔄 Arduino to Web Asset Converter")
-print("=" * 60)
-print()
-
-# Configuration
-ARDUINO_PROJECT = input("Path to Arduino project folder (or press Enter to skip): ").strip()
-if not ARDUINO_PROJECT:
-    ARDUINO_PROJECT = "./arduino-project"
-
-WEB_PROJECT = "./"  # Current directory
-
-# Create output directories
-os.makedirs("assets/images", exist_ok=True)
-os.makedirs("assets/audio", exist_ok=True)
-
-# Load tokens database - try submodule path first, then root
-tokens = None
-TOKENS_FILE = None
-try:
-    with open('data/tokens.json', 'r') as f:
-        tokens = json.load(f)
-        TOKENS_FILE = 'data/tokens.json'
-    print(f"✅ Loaded {len(tokens)} tokens from data/tokens.json")
-except FileNotFoundError:
+import shutil
+import subprocess
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from PIL import Image, ImageDraw, features
+
+from aln_common import load_cached_tokens
+
+
+def norm(name):
+    """Normalize a file stem or token ID: ignore case, underscores and colons"""
+    return name.lower().replace('_', '').replace(':', '')
+
+
+def build_index(dirs, exts):
+    """Scan each directory once and map normalized file stems to DirEntry.
+    
+    Earlier directories take priority when the same name appears twice.
+    DirEntry caches its stat() result, so later mtime checks are free.
+    """
+    index = {}
+    for d in dirs:
+        if not os.path.isdir(d):
+            continue
+        with os.scandir(d) as entries:
+            for entry in entries:
+                stem, ext = os.path.splitext(entry.name)
+                if ext.lower() in exts and entry.is_file():
+                    index.setdefault(norm(stem), entry)
+    return index
+
+
+def scan_outputs(d):
+    """Map file names already in an output directory to their DirEntry"""
+    if not os.path.isdir(d):
+        return {}
+    with os.scandir(d) as entries:
+        return {entry.name: entry for entry in entries if entry.is_file()}
+
+
+def existing_stems(outputs, ext):
+    """Token IDs that already have an output file with the given extension"""
+    return {name[:-len(ext)] for name in outputs if name.endswith(ext)}
+
+
+# Source file each output was last converted from, as {output path:
+# [source path, mtime_ns, size]}. Outputs not listed here - placeholders,
+# files from a git checkout - are always converted again
+MANIFEST_FILE = '.convert_manifest.json'
+
+
+def load_manifest():
+    """Load the conversion manifest, or an empty one if missing/unreadable"""
     try:
-        with open('tokens.json', 'r') as f:
-            tokens = json.load(f)
-            TOKENS_FILE = 'tokens.json'
-        print(f"✅ Loaded {len(tokens)} tokens from tokens.json")
-    except FileNotFoundError:
-        print("❌ tokens.json not found!")
-        print("Please ensure tokens.json exists in data/ or current directory")
-        exit(1)
-
-print()
-print("🖼️ Converting Images...")
-print("-" * 40)
-
-converted_images = 0
-missing_images = []
-
-# Process images for ALL tokens
-for token_id in tokens.keys():
-    # Try multiple possible filenames for this token
-    # Including uppercase ID, lowercase, and with underscores/colons
-    possible_names = [
-        token_id,
-        token_id.upper(),
-        token_id.lower(),
-        token_id.replace('_', ''),
-        token_id.replace(':', ''),
-        token_id.replace(':', '_'),
-    ]
+        with open(MANIFEST_FILE, 'rb') as f:
+            manifest = json.loads(f.read())
+    except (OSError, ValueError):
+        return {}
+    return manifest if isinstance(manifest, dict) else {}
+
+
+def save_manifest(manifest):
+    """Write the conversion manifest via a temp file"""
+    tmp_path = MANIFEST_FILE + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, MANIFEST_FILE)
+
+
+def source_key(source):
+    """Identify a source file's current contents by path, mtime and size"""
+    st = source.stat()
+    return [source.path, st.st_mtime_ns, st.st_size]
+
+
+def is_up_to_date(source, output, manifest):
+    """True if the output exists and was converted from this exact source"""
+    return output is not None and manifest.get(output.path) == source_key(source)
+
+
+def find_source(token_id, index):
+    """Look up a token's source DirEntry regardless of case/underscores/colons"""
+    return index.get(norm(token_id))
+
+
+def convert_one(job):
+    """Convert one BMP to a web JPG; runs in a worker process"""
+    token_id, bmp_path = job
+    name = os.path.basename(bmp_path)
+    output_path = f"assets/images/{token_id}.jpg"
+    tmp_path = output_path + '.tmp'
     
-    source_found = False
-    for name in possible_names:
-        # Look for BMP file in various locations
-        # First check in current project's assets folder
-        bmp_paths = [
-            f"assets/images/{name}.BMP",
-            f"assets/images/{name}.bmp",
-            f"{ARDUINO_PROJECT}/images/{name}.BMP",
-            f"{ARDUINO_PROJECT}/images/{name}.bmp",
-            f"{ARDUINO_PROJECT}/{name}.BMP",
-            f"{ARDUINO_PROJECT}/{name}.bmp",
-            f"{ARDUINO_PROJECT}/SD_Card/{name}.BMP",
-            f"{ARDUINO_PROJECT}/SD_Card/{name}.bmp",
-        ]
+    try:
+        # Open BMP
+        img = Image.open(bmp_path)
         
-        for bmp_path in bmp_paths:
-            if os.path.exists(bmp_path):
-                source_found = True
-                output_path = f"assets/images/{token_id}.jpg"
-                
-                try:
-                    # Open BMP
-                    img = Image.open(bmp_path)
-                    
-                    # Convert to RGB if needed
-                    if img.mode != 'RGB':
-                        img = img.convert('RGB')
-                    
-                    # Resize to web-friendly size (max 800x800)
-                    img.thumbnail((800, 800), Image.Resampling.LANCZOS)
-                    
-                    # Save as JPG
-                    img.save(output_path, 'JPEG', quality=85, optimize=True)
-                    
-                    # Get file size
-                    size_kb = os.path.getsize(output_path) / 1024
-                    print(f"  ✓ {name}.BMP → {token_id}.jpg ({size_kb:.1f}KB)")
-                    converted_images += 1
-                    
-                except Exception as e:
-                    print(f"  ✗ Error converting {name}.BMP: {e}")
-                
-                break
+        # Convert to RGB if needed
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
         
-        if source_found:
-            break
-    
-    if not source_found:
-        missing_images.append(token_id)
+        # Resize to web-friendly size (max 800x800)
+        # Small Arduino sources pass through; modest downscales use BILINEAR
+        scale = max(img.size) / 800
+        if scale > 2.0:
+            img.thumbnail((800, 800), Image.Resampling.LANCZOS)
+        elif scale > 1.0:
+            img.thumbnail((800, 800), Image.Resampling.BILINEAR)
+        
+        # Save as JPG via a temp file so an interrupted run never leaves a
+        # partial JPG that looks up to date
+        img.save(tmp_path, 'JPEG', quality=85, optimize=True, progressive=True)
+        os.replace(tmp_path, output_path)
+        
+        # Get file size
+        size_kb = os.path.getsize(output_path) / 1024
+        return token_id, name, size_kb, None
+        
+    except Exception as e:
+        # Don't leave a half-written temp file in assets/ to be committed
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return token_id, name, 0, e
+
 
-# Create placeholders for missing images
-if missing_images:
+def wav_is_mp3(wav_path):
+    """Check the WAVE fmt chunk for MPEG Layer 3 audio (format tag 0x0055)"""
+    try:
+        with open(wav_path, 'rb') as f:
+            header = f.read(12)
+            if header[:4] != b'RIFF' or header[8:12] != b'WAVE':
+                return False
+            # Walk chunks until the fmt chunk
+            while True:
+                chunk = f.read(8)
+                if len(chunk) < 8:
+                    return False
+                chunk_id, size = chunk[:4], int.from_bytes(chunk[4:], 'little')
+                if chunk_id == b'fmt ':
+                    return int.from_bytes(f.read(2), 'little') == 0x0055
+                f.seek(size + (size & 1), os.SEEK_CUR)
+    except OSError:
+        return False
+
+
+def encode_one(job):
+    """Convert one WAV to MP3 with ffmpeg; returns True on success"""
+    token_id, wav_path, output_path = job
+    if wav_is_mp3(wav_path):
+        # Already MP3 inside a WAV container - just rewrap the stream
+        codec = ['-codec:a', 'copy']
+    else:
+        # Mono 22.05kHz VBR is plenty for Arduino-sourced clips
+        # (compression_level sets LAME's algorithm quality: 9 is fastest, 0 slowest)
+        codec = [
+            '-ac', '1', '-ar', '22050',
+            '-codec:a', 'libmp3lame', '-q:a', '5', '-compression_level', '9',
+        ]
+    # Encode to a temp file and rename it into place once ffmpeg succeeds
+    tmp_path = output_path + '.tmp'
+    cmd = [
+        'ffmpeg', '-nostdin', '-loglevel', 'error', '-threads', '1',
+        '-i', wav_path,
+        *codec,
+        '-f', 'mp3', '-y', tmp_path,
+    ]
+    result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    if result.returncode != 0:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False
+    os.replace(tmp_path, output_path)
+    return True
+
+
+def main():
+    """Main function"""
+    print("=" * 60)
+    print("🔄 Arduino to Web Asset Converter")
+    print("=" * 60)
     print()
-    print("📸 Creating placeholders for missing images...")
-    
-    # Map memory types to colors
-    colors = {
-        'Personal': (79, 189, 186),
-        'Technical': (126, 200, 227),
-        'Mention': (163, 230, 53),       # Lime green
-        'Business': (231, 76, 60),
-        'Party': (192, 132, 252),        # Purple
-        'Military': (149, 165, 166),
-        'Intelligence': (44, 62, 80),
-        'Test': (100, 100, 100)
-    }
-    
-    for token_id in missing_images:
-        if token_id not in tokens:
-            continue
+
+    # Configuration
+    ARDUINO_PROJECT = input("Path to Arduino project folder (or press Enter to skip): ").strip()
+    if not ARDUINO_PROJECT:
+        ARDUINO_PROJECT = "./arduino-project"
+
+    WEB_PROJECT = "./"  # Current directory
+
+    # Create output directories
+    os.makedirs("assets/images", exist_ok=True)
+    os.makedirs("assets/audio", exist_ok=True)
+
+    # Load tokens database - try submodule path first, then root
+    tokens = None
+    TOKENS_FILE = None
+    try:
+        tokens = load_cached_tokens('data/tokens.json')
+        TOKENS_FILE = 'data/tokens.json'
+        print(f"✅ Loaded {len(tokens)} tokens from data/tokens.json")
+    except FileNotFoundError:
+        try:
+            tokens = load_cached_tokens('tokens.json')
+            TOKENS_FILE = 'tokens.json'
+            print(f"✅ Loaded {len(tokens)} tokens from tokens.json")
+        except FileNotFoundError:
+            print("❌ tokens.json not found!")
+            print("Please ensure tokens.json exists in data/ or current directory")
+            exit(1)
+
+    print()
+    print("🖼️ Converting Images...")
+    print("-" * 40)
+
+    # Pillow's JPEG encoder only gets SIMD DCT/Huffman kernels from libjpeg-turbo
+    if not features.check_feature('libjpeg_turbo'):
+        print("  ⚠ Pillow was built without libjpeg-turbo - JPEG encoding will be slow")
+        print("  Reinstall Pillow from the official wheels: pip install --force-reinstall pillow")
+
+    converted_images = 0
+    skipped_images = 0
+    missing_images = []
+
+    # Index candidate image files once instead of probing every name/location
+    # First check in current project's assets folder
+    image_index = build_index([
+        "assets/images",
+        f"{ARDUINO_PROJECT}/images",
+        ARDUINO_PROJECT,
+        f"{ARDUINO_PROJECT}/SD_Card",
+    ], {'.bmp'})
+
+    # Collect conversion jobs for ALL tokens, skipping JPGs already
+    # converted from their current BMP
+    manifest = load_manifest()
+    image_outputs = scan_outputs("assets/images")
+    have_images = existing_stems(image_outputs, '.jpg')
+    jobs = []
+    sources = {}
+    for token_id in tokens.keys():
+        bmp_entry = find_source(token_id, image_index)
         
-        output_path = f"assets/images/{token_id}.jpg"
+        if bmp_entry is None:
+            missing_images.append(token_id)
+        elif is_up_to_date(bmp_entry, image_outputs.get(f"{token_id}.jpg"), manifest):
+            skipped_images += 1
+        else:
+            jobs.append((token_id, bmp_entry.path))
+            sources[token_id] = source_key(bmp_entry)
+    
+    # Encode on every core; results come back in order and are printed here
+    if jobs:
+        workers = os.cpu_count() or 1
+        chunksize = max(1, len(jobs) // (4 * workers))
+        with ProcessPoolExecutor(max_workers=workers) as ex:
+            for token_id, name, size_kb, err in ex.map(convert_one, jobs, chunksize=chunksize):
+                if err:
+                    print(f"  ✗ Error converting {name}: {err}")
+                else:
+                    print(f"  ✓ {name} → {token_id}.jpg ({size_kb:.1f}KB)")
+                    converted_images += 1
+                    have_images.add(token_id)
+                    manifest[f"assets/images/{token_id}.jpg"] = sources[token_id]
+
+    # Create placeholders for missing images
+    if missing_images:
+        print()
+        print("📸 Creating placeholders for missing images...")
         
-        # Skip if already exists
-        if os.path.exists(output_path):
-            print(f"  ⚠ {token_id}.jpg already exists")
-            continue
+        # Map memory types to colors
+        colors = {
+            'Personal': (79, 189, 186),
+            'Technical': (126, 200, 227),
+            'Mention': (163, 230, 53),       # Lime green
+            'Business': (231, 76, 60),
+            'Party': (192, 132, 252),        # Purple
+            'Military': (149, 165, 166),
+            'Intelligence': (44, 62, 80),
+            'Test': (100, 100, 100)
+        }
         
-        # Create placeholder based on SF_MemoryType
-        token_data = tokens[token_id]
-        memory_type = token_data.get('SF_MemoryType', 'Unknown')
-        color = colors.get(memory_type, (136, 136, 136))
+        # One filled canvas per color, copied for each token that uses it
+        backgrounds = {}
         
-        img = Image.new('RGB', (800, 800), color=color)
-        from PIL import ImageDraw
-        draw = ImageDraw.Draw(img)
+        for token_id in missing_images:
+            if token_id not in tokens:
+                continue
+            
+            output_path = f"assets/images/{token_id}.jpg"
+            
+            # Skip if already exists
+            if token_id in have_images:
+                print(f"  ⚠ {token_id}.jpg already exists")
+                continue
+            
+            # Create placeholder based on SF_MemoryType
+            token_data = tokens[token_id]
+            memory_type = token_data.get('SF_MemoryType', 'Unknown')
+            color = colors.get(memory_type, (136, 136, 136))
+            
+            if color not in backgrounds:
+                backgrounds[color] = Image.new('RGB', (800, 800), color=color)
+            img = backgrounds[color].copy()
+            draw = ImageDraw.Draw(img)
+            
+            # Add token ID text (no title since it's not in player-visible fields)
+            # Simple centered text with token ID
+            draw.text((400, 400), token_id, fill='white', anchor='mm')
+            
+            tmp_path = output_path + '.tmp'
+            img.save(tmp_path, 'JPEG', quality=82, progressive=True)
+            os.replace(tmp_path, output_path)
+            have_images.add(token_id)
+            manifest.pop(output_path, None)
+            print(f"  ✓ Created placeholder for {token_id}")
+
+    print()
+    print("🎵 Converting Audio...")
+    print("-" * 40)
+
+    # Existing MP3s are listed even without ffmpeg so tokens.json still
+    # points at audio converted on an earlier run
+    audio_outputs = scan_outputs("assets/audio")
+    have_audio = existing_stems(audio_outputs, '.mp3')
+
+    # Check if ffmpeg is available for audio conversion
+    ffmpeg_available = shutil.which("ffmpeg") is not None
+
+    if not ffmpeg_available:
+        print("  ⚠ ffmpeg not found - skipping audio conversion")
+        print("  Install ffmpeg to convert WAV files to MP3:")
+        print("  Ubuntu/Debian: sudo apt install ffmpeg")
+        print("  macOS: brew install ffmpeg")
+    else:
+        converted_audio = 0
+        skipped_audio = 0
         
-        # Add token ID text (no title since it's not in player-visible fields)
-        # Simple centered text with token ID
-        draw.text((400, 400), token_id, fill='white', anchor='mm')
+        # Index candidate audio files once
+        # First check in current project's assets folder
+        audio_index = build_index([
+            "assets/audio",
+            f"{ARDUINO_PROJECT}/audio",
+            ARDUINO_PROJECT,
+            f"{ARDUINO_PROJECT}/SD_Card",
+        ], {'.wav'})
         
-        img.save(output_path, 'JPEG', quality=85)
-        print(f"  ✓ Created placeholder for {token_id}")
-
-print()
-print("🎵 Converting Audio...")
-print("-" * 40)
-
-# Check if ffmpeg is available for audio conversion
-ffmpeg_available = os.system("which ffmpeg > /dev/null 2>&1") == 0
-
-if not ffmpeg_available:
-    print("  ⚠ ffmpeg not found - skipping audio conversion")
-    print("  Install ffmpeg to convert WAV files to MP3:")
-    print("  Ubuntu/Debian: sudo apt install ffmpeg")
-    print("  macOS: brew install ffmpeg")
-else:
-    converted_audio = 0
-    
-    # Process audio for ALL tokens
-    for token_id in tokens.keys():
-        # Try multiple possible filenames for this token
-        possible_names = [
-            token_id,
-            token_id.upper(),
-            token_id.lower(),
-            token_id.replace('_', ''),
-            token_id.replace(':', ''),
-            token_id.replace(':', '_'),
-        ]
+        # Collect encode jobs for ALL tokens, skipping MP3s already
+        # encoded from their current WAV
+        jobs = []
+        sources = {}
+        for token_id in tokens.keys():
+            wav_entry = find_source(token_id, audio_index)
+            if wav_entry is None:
+                continue
+            if is_up_to_date(wav_entry, audio_outputs.get(f"{token_id}.mp3"), manifest):
+                skipped_audio += 1
+            else:
+                jobs.append((token_id, wav_entry.path, f"assets/audio/{token_id}.mp3"))
+                sources[token_id] = source_key(wav_entry)
         
-        source_found = False
-        for name in possible_names:
-            # Look for WAV file in various locations
-            # First check in current project's assets folder
-            wav_paths = [
-                f"assets/audio/{name}.WAV",
-                f"assets/audio/{name}.wav",
-                f"{ARDUINO_PROJECT}/audio/{name}.WAV",
-                f"{ARDUINO_PROJECT}/audio/{name}.wav",
-                f"{ARDUINO_PROJECT}/{name}.WAV",
-                f"{ARDUINO_PROJECT}/{name}.wav",
-                f"{ARDUINO_PROJECT}/SD_Card/{name}.WAV",
-                f"{ARDUINO_PROJECT}/SD_Card/{name}.wav",
-            ]
-            
-            for wav_path in wav_paths:
-                if os.path.exists(wav_path):
-                    output_path = f"assets/audio/{token_id}.mp3"
-                    
-                    # Convert WAV to MP3 using ffmpeg
-                    cmd = f'ffmpeg -i "{wav_path}" -codec:a libmp3lame -b:a 128k "{output_path}" -y > /dev/null 2>&1'
-                    result = os.system(cmd)
-                    
-                    if result == 0:
+        # ffmpeg does the work in its own process, so threads are enough
+        # to keep one single-threaded encoder busy per core
+        if jobs:
+            workers = min(len(jobs), os.cpu_count() or 1)
+            with ThreadPoolExecutor(max_workers=workers) as ex:
+                for (token_id, wav_path, output_path), ok in zip(jobs, ex.map(encode_one, jobs)):
+                    name = os.path.basename(wav_path)
+                    if ok:
                         size_kb = os.path.getsize(output_path) / 1024
-                        print(f"  ✓ {name}.WAV → {token_id}.mp3 ({size_kb:.1f}KB)")
+                        print(f"  ✓ {name} → {token_id}.mp3 ({size_kb:.1f}KB)")
                         converted_audio += 1
+                        have_audio.add(token_id)
+                        manifest[output_path] = sources[token_id]
                     else:
-                        print(f"  ✗ Error converting {name}.WAV")
-                    
-                    source_found = True
-                    break
-            
-            if source_found:
-                break
-
-print()
-print("=" * 60)
-print("📊 Conversion Summary")
-print("=" * 60)
-print(f"✅ Images converted: {converted_images}")
-print(f"📸 Placeholders created: {len(missing_images)}")
-if ffmpeg_available:
-    print(f"🎵 Audio files converted: {converted_audio}")
-print()
-
-# Update tokens.json with actual file paths
-print("📝 Updating tokens.json...")
-for token_id, token_data in tokens.items():
-    # Check if image exists
-    image_path = f"assets/images/{token_id}.jpg"
-    if os.path.exists(image_path):
-        token_data['image'] = image_path
-    else:
-        print(f"  ⚠ Missing image for {token_id}")
-    
-    # Check if audio exists
-    audio_path = f"assets/audio/{token_id}.mp3"
-    if os.path.exists(audio_path):
-        token_data['audio'] = audio_path
-    else:
-        # Set to null if no audio
-        token_data['audio'] = None
-
-# Save updated tokens.json
-with open(TOKENS_FILE, 'w') as f:
-    json.dump(tokens, f, indent=2)
-print("✅ tokens.json updated")
-
-print()
-print("🎯 Next Steps:")
-print("1. Review converted images in assets/images/")
-print("2. Review converted audio in assets/audio/")
-print("3. Generate QR codes: python3 generate_qr.py")
-print("4. Push to GitHub: git add . && git commit -m 'Added assets' && git push")
-print()
-print("✨ Conversion complete!")
\ No newline at end of file
+                        print(f"  ✗ Error converting {name}")
+
+    print()
+    print("=" * 60)
+    print("📊 Conversion Summary")
+    print("=" * 60)
+    print(f"✅ Images converted: {converted_images}")
+    if skipped_images > 0:
+        print(f"⏭️  Images up to date: {skipped_images}")
+    print(f"📸 Placeholders created: {len(missing_images)}")
+    if ffmpeg_available:
+        print(f"🎵 Audio files converted: {converted_audio}")
+        if skipped_audio > 0:
+            print(f"⏭️  Audio up to date: {skipped_audio}")
+    print()
+
+    save_manifest(manifest)
+
+    # Update tokens.json with actual file paths
+    print("📝 Updating tokens.json...")
+    # Outputs were listed before conversion and tracked as they were
+    # written, so no directory needs to be read again here
+    for token_id, token_data in tokens.items():
+        # Check if image exists
+        image_path = f"assets/images/{token_id}.jpg"
+        if token_id in have_images:
+            token_data['image'] = image_path
+        else:
+            print(f"  ⚠ Missing image for {token_id}")
+        
+        # Check if audio exists
+        audio_path = f"assets/audio/{token_id}.mp3"
+        if token_id in have_audio:
+            token_data['audio'] = audio_path
+        else:
+            # Set to null if no audio
+            token_data['audio'] = None
+
+    # Save updated tokens.json - serialize once, then a single buffered write
+    with open(TOKENS_FILE, 'wb', buffering=1 << 20) as f:
+        f.write(json.dumps(tokens, indent=2).encode('utf-8'))
+    print("✅ tokens.json updated")
+
+    print()
+    print("🎯 Next Steps:")
+    print("1. Review converted images in assets/images/")
+    print("2. Review converted audio in assets/audio/")
+    print("3. Generate QR codes: python3 generate_qr.py")
+    print("4. Push to GitHub: git add . && git commit -m 'Added assets' && git push")
+    print()
+    print("✨ Conversion complete!")
+
+if __name__ == "__main__":
+    main()
@@ -5,9 +5,11 @@ Works with new SF_ schema fields
 """
 
 from PIL import Image, ImageDraw, ImageFont
-import json
+import textwrap
 import os
 
+from aln_common import load_cached_tokens
+
 # Create output directory
 os.makedirs('assets/images', exist_ok=True)
 
@@ -24,22 +26,56 @@ colors = {
     'Classified': (20, 20, 40)       # Very dark blue
 }
 
+def load_font(size):
+    """Load a system font at the given size, falling back to Pillow's default"""
+    # Try different font options, then other common font paths
+    for font_path in ("arial.ttf", "/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf"):
+        try:
+            return ImageFont.truetype(font_path, size)
+        except OSError:
+            pass
+    # Use default font
+    return ImageFont.load_default()
+
 # Load tokens - try submodule path first, then root
 tokens = None
 try:
-    with open('data/tokens.json', 'r') as f:
-        tokens = json.load(f)
+    tokens = load_cached_tokens('data/tokens.json')
     print(f"Loaded {len(tokens)} tokens from data/tokens.json")
 except FileNotFoundError:
     try:
-        with open('tokens.json', 'r') as f:
-            tokens = json.load(f)
+        tokens = load_cached_tokens('tokens.json')
         print(f"Loaded {len(tokens)} tokens from tokens.json")
     except FileNotFoundError:
         print("ERROR: tokens.json not found!")
         print("Please make sure tokens.json exists in data/ or current directory")
         exit(1)
 
+# Resolve fonts once rather than per token
+FONT_LARGE = load_font(60)
+FONT_SMALL = load_font(30)
+FONT_HUGE = load_font(120)
+
+# Characters per title line, sized from the large font's widest glyph
+CHARS_PER_LINE = max(1, int(700 / FONT_LARGE.getlength('M')))
+
+# Pre-rendered background + memory type badge, one per SF_MemoryType;
+# each token copies its template and only draws its own text
+TEMPLATES = {}
+
+def get_template(memory_type):
+    """Return the shared background for a memory type, rendering it on first use"""
+    template = TEMPLATES.get(memory_type)
+    if template is None:
+        color = colors.get(memory_type, (136, 136, 136))  # Default gray
+        template = Image.new('RGB', (800, 800), color=color)
+        
+        # Add memory type badge (for debugging, but subtle)
+        type_text = f"[{memory_type}]"
+        ImageDraw.Draw(template).text((400, 115), type_text, fill=(255, 255, 255, 200), font=FONT_SMALL, anchor='mm')
+        TEMPLATES[memory_type] = template
+    return template
+
 print("\nCreating placeholder images...")
 print("-" * 40)
 
@@ -48,6 +84,7 @@ skipped_count = 0
 
 for token_id, token_data in tokens.items():
     output_path = f'assets/images/{token_id}.jpg'
+    tmp_path = output_path + '.tmp'
     
     # Skip if file already exists
     if os.path.exists(output_path):
@@ -56,99 +93,48 @@ for token_id, token_data in tokens.items():
         continue
     
     try:
-        # Get color for this token's SF_MemoryType
+        # Get background for this token's SF_MemoryType
         memory_type = token_data.get('SF_MemoryType', 'Unknown')
-        color = colors.get(memory_type, (136, 136, 136))  # Default gray
+        template = get_template(memory_type)
         
-        # Create image with RGB color tuple
-        img = Image.new('RGB', (800, 800), color=color)
+        # Copy the pre-rendered background instead of drawing a new image
+        img = template.copy()
         draw = ImageDraw.Draw(img)
         
         # For player scanner, we don't show title - just use token ID
         title = token_id
         
-        # Try to use a system font, fallback to default
-        try:
-            # Try different font options
-            font_large = ImageFont.truetype("arial.ttf", 60)
-            font_small = ImageFont.truetype("arial.ttf", 30)
-        except:
-            try:
-                # Try other common font paths
-                font_large = ImageFont.truetype("/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf", 60)
-                font_small = ImageFont.truetype("/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf", 30)
-            except:
-                # Use default font
-                font_large = ImageFont.load_default()
-                font_small = ImageFont.load_default()
-        
-        # Split title into words for wrapping
-        words = title.split()
-        lines = []
-        current_line = []
-        
-        for word in words:
-            current_line.append(word)
-            test_line = ' '.join(current_line)
-            # Check if line is too long (approximate)
-            if len(test_line) > 20:  # Simple character count check
-                if len(current_line) > 1:
-                    current_line.pop()
-                    lines.append(' '.join(current_line))
-                    current_line = [word]
-                else:
-                    lines.append(test_line)
-                    current_line = []
+        # Wrap title to the line width; single words need no wrapping
+        if ' ' in title:
+            lines = textwrap.wrap(title, width=CHARS_PER_LINE, break_long_words=False) or [title]
+        else:
+            lines = [title]
         
-        if current_line:
-            lines.append(' '.join(current_line))
-        
-        # Draw title lines
-        y_offset = 350
+        # Draw title lines, centered on each line's midpoint
+        y_offset = 380
         for line in lines:
-            try:
-                # Try to get text size for centering
-                bbox = draw.textbbox((0, 0), line, font=font_large)
-                text_width = bbox[2] - bbox[0]
-                x = (800 - text_width) // 2
-            except:
-                # Fallback to simple centering
-                x = 400
-                
-            draw.text((x, y_offset), line, fill=(255, 255, 255), font=font_large, anchor=None)
+            draw.text((400, y_offset), line, fill=(255, 255, 255), font=FONT_LARGE, anchor='mm')
             y_offset += 70
         
         # Add token ID at bottom
-        try:
-            bbox = draw.textbbox((0, 0), token_id, font=font_small)
-            text_width = bbox[2] - bbox[0]
-            x = (800 - text_width) // 2
-        except:
-            x = 400
-            
-        draw.text((x, 700), f"ID: {token_id}", fill=(255, 255, 255, 180), font=font_small)
+        draw.text((400, 715), f"ID: {token_id}", fill=(255, 255, 255, 180), font=FONT_SMALL, anchor='mm')
         
-        # Add memory type badge (for debugging, but subtle)
-        type_text = f"[{memory_type}]"
-        try:
-            bbox = draw.textbbox((0, 0), type_text, font=font_small)
-            text_width = bbox[2] - bbox[0]
-            x = (800 - text_width) // 2
-        except:
-            x = 400
-            
-        draw.text((x, 100), type_text, fill=(255, 255, 255, 200), font=font_small)
-        
-        # Save image
-        img.save(output_path, 'JPEG', quality=85)
+        # Save image via a temp file so an interrupted run can't leave a
+        # partial JPG that the exists check above would skip forever
+        img.save(tmp_path, 'JPEG', quality=82, progressive=True)
+        os.replace(tmp_path, output_path)
         print(f'  ✓ Created {token_id}.jpg ({memory_type})')
         created_count += 1
         
     except Exception as e:
+        # Don't leave a half-written temp file in assets/ to be committed
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
         print(f'  ✗ Error generating {token_id}: {e}')
 
 # Create a generic placeholder image
 placeholder_path = 'assets/images/placeholder.jpg'
+tmp_path = placeholder_path + '.tmp'
 if not os.path.exists(placeholder_path):
     try:
         # Create a gray placeholder
@@ -156,18 +142,16 @@ if not os.path.exists(placeholder_path):
         draw = ImageDraw.Draw(img)
         
         # Add question mark or text
-        try:
-            font = ImageFont.truetype("arial.ttf", 120)
-        except:
-            font = ImageFont.load_default()
-        
-        draw.text((400, 400), "?", fill=(255, 255, 255))
-        draw.text((400, 500), "Image Not Found", fill=(255, 255, 255, 180))
+        draw.text((400, 400), "?", fill=(255, 255, 255), font=FONT_HUGE, anchor='mm')
+        draw.text((400, 500), "Image Not Found", fill=(255, 255, 255, 180), font=FONT_SMALL, anchor='mm')
         
-        img.save(placeholder_path, 'JPEG', quality=85)
+        img.save(tmp_path, 'JPEG', quality=82, progressive=True)
+        os.replace(tmp_path, placeholder_path)
         print(f'  ✓ Created placeholder.jpg')
         
     except Exception as e:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
         print(f'  ✗ Error creating placeholder: {e}')
 
 print("\n" + "=" * 40)
@@ -5,207 +5,196 @@ Generates QR codes for all tokens in tokens.json
 """
 
 import qrcode
-import json
 import os
-from PIL import Image, ImageDraw, ImageFont
+import sys
+from functools import partial
+from multiprocessing import Pool
+from pathlib import Path
+from PIL import Image, ImageDraw, ImageFont, ImageOps
 
-def generate_simple_qr():
-    """Generate simple black and white QR codes"""
-    # Create output directory
-    os.makedirs('qr-codes', exist_ok=True)
-    
-    # Load tokens - try submodule path first, then root
-    tokens = None
-    try:
-        with open('data/tokens.json', 'r') as f:
-            tokens = json.load(f)
-            print("✅ Loaded tokens from data/tokens.json")
-    except FileNotFoundError:
-        try:
-            with open('tokens.json', 'r') as f:
-                tokens = json.load(f)
-                print("✅ Loaded tokens from tokens.json")
-        except FileNotFoundError:
-            print("❌ tokens.json not found in data/ or root!")
-            print("Please ensure tokens.json exists")
-            return
-    
-    print("Generating QR codes...")
-    generated = 0
-    
-    for token_id in tokens.keys():
-        try:
-            # Create QR code
-            qr = qrcode.QRCode(
-                version=1,
-                error_correction=qrcode.constants.ERROR_CORRECT_H,
-                box_size=10,
-                border=4,
-            )
-            
-            # Add token ID as data
-            qr.add_data(token_id)
-            qr.make(fit=True)
-            
-            # Create image - use simple black and white
-            img = qr.make_image(fill_color="black", back_color="white")
-            
-            # Save QR code
-            output_path = f'qr-codes/{token_id}.png'
-            img.save(output_path)
-            print(f'  ✓ Generated {token_id}.png')
-            generated += 1
-            
-        except Exception as e:
-            print(f'  ✗ Error generating {token_id}: {e}')
-    
-    print(f"\n✅ Generated {generated} QR codes in qr-codes/ directory")
-    return generated
+from aln_common import QR_MASK_PATTERN, load_cached_tokens, render_qr
 
-def generate_labeled_qr():
-    """Generate QR codes with labels for easier identification"""
-    os.makedirs('qr-codes', exist_ok=True)
-    
-    # Load tokens - try submodule path first, then root
-    tokens = None
+# Output directory for every QR variant
+QR_DIR = Path('qr-codes')
+
+# Color scheme using RGB tuples
+COLORS = {
+    'Personal': (79, 189, 186),      # Teal
+    'Technical': (126, 200, 227),    # Light blue
+    'Mention': (163, 230, 53),       # Lime green
+    'Business': (231, 76, 60),       # Red
+    'Party': (192, 132, 252),        # Purple
+    'Military': (149, 165, 166),     # Gray
+    'Intelligence': (44, 62, 80),    # Dark blue
+    'Test': (136, 136, 136),         # Gray
+    'Classified': (20, 20, 40)       # Very dark blue
+}
+
+# Per-process state: each worker builds its own QR code object and font
+# once at import and reuses them for every token it handles
+QR = qrcode.QRCode(
+    version=1,
+    error_correction=qrcode.constants.ERROR_CORRECT_H,
+    box_size=10,
+    border=4,
+    mask_pattern=QR_MASK_PATTERN,
+)
+
+# Try to use a font (fallback to default if not available); loaded once per
+# process rather than once per labeled token
+try:
+    LABEL_FONT = ImageFont.truetype("arial.ttf", 16)
+except OSError:
+    LABEL_FONT = ImageFont.load_default()
+
+def _make_qr(token_id):
+    """Encode a token ID into this process's shared QR code object"""
+    # Reset version so one long ID doesn't enlarge every code after it
+    QR.clear()
+    QR.version = 1
+    
+    # Add token ID as data
+    QR.add_data(token_id)
+    QR.make(fit=True)
+    return QR
+
+def compute_matrix(token_id):
+    """Render a token's QR code once as a 1-bit image (dark modules = 0)"""
+    return render_qr(_make_qr(token_id))
+
+def _run_parallel(worker, items):
+    """Run worker over items on all cores, yielding results as they finish"""
+    items = list(items)
+    if not items:
+        return
+    # No more processes than items, and small chunks so a few dozen
+    # tokens still spread across every worker
+    workers = min(len(items), os.cpu_count() or 1)
+    chunksize = max(1, len(items) // (4 * workers))
+    with Pool(processes=workers) as pool:
+        yield from pool.imap_unordered(worker, items, chunksize=chunksize)
+
+def _save_png(img, output_path):
+    """Save a PNG through a file handle with a larger-than-default write buffer"""
+    with output_path.open('wb', buffering=1 << 16) as f:
+        img.save(f, format='PNG', compress_level=1, optimize=False)
+
+def _render_simple(token_id, token_data, matrix):
+    """Write the black and white QR code"""
+    # Save QR code
+    output_path = QR_DIR / f'{token_id}.png'
+    _save_png(matrix, output_path)
+    return f'{token_id}.png'
+
+def _render_labeled(token_id, token_data, qr_img):
+    """Write the QR code with an ID/type/rating label underneath"""
+    # Create a larger image with label space
+    width, height = qr_img.size
+    labeled_img = Image.new('RGB', (width, height + 60), 'white')
+    
+    # Paste QR code
+    labeled_img.paste(qr_img, (0, 0))
+    
+    # Add label
+    draw = ImageDraw.Draw(labeled_img)
+    
+    # Add token ID
+    text = f"ID: {token_id}"
+    draw.text((10, height + 5), text, fill='black', font=LABEL_FONT)
+    
+    # Add memory type and group (for GM reference)
+    memory_type = token_data.get('SF_MemoryType', 'Unknown')
+    group = token_data.get('SF_Group', '')[:30]
+    draw.text((10, height + 25), f"Type: {memory_type}", fill='gray', font=LABEL_FONT)
+    
+    # Add value rating with stars
+    rating = '⭐' * token_data.get('SF_ValueRating', 0)
+    draw.text((10, height + 45), rating, fill='black', font=LABEL_FONT)
+    
+    # Save labeled version
+    output_path = QR_DIR / f'{token_id}_labeled.png'
+    _save_png(labeled_img, output_path)
+    return f'{token_id}_labeled.png'
+
+def _render_color(token_id, token_data, matrix):
+    """Write the QR code colored by SF_MemoryType"""
+    # Get color for this token's SF_MemoryType
+    memory_type = token_data.get('SF_MemoryType', 'Unknown')
+    color = COLORS.get(memory_type, (0, 0, 0))  # Default to black
+    
+    # Recolor the shared matrix in one pass: dark modules -> color, light -> white
+    img = ImageOps.colorize(matrix.convert('L'), black=color, white='white')
+    
+    # Save colored version
+    output_path = QR_DIR / f'{token_id}_color.png'
+    _save_png(img, output_path)
+    return f'{token_id}_color.png ({memory_type})'
+
+# Variant name -> (renderer, error label, summary label)
+VARIANTS = {
+    'simple': (_render_simple, '', 'QR codes in qr-codes/ directory'),
+    'labeled': (_render_labeled, 'labeled ', 'labeled QR codes'),
+    'color': (_render_color, 'colored ', 'colored QR codes'),
+}
+
+def _gen_token(item, variants):
+    """Worker: encode one token's matrix once and write each requested variant"""
+    token_id, token_data = item
     try:
-        with open('data/tokens.json', 'r') as f:
-            tokens = json.load(f)
-    except FileNotFoundError:
-        try:
-            with open('tokens.json', 'r') as f:
-                tokens = json.load(f)
-        except FileNotFoundError:
-            print("❌ tokens.json not found!")
-            return
+        matrix = compute_matrix(token_id)
+    except Exception as e:
+        return token_id, [(variant, None, e) for variant in variants]
     
-    print("\nGenerating labeled QR codes...")
-    generated = 0
-    
-    for token_id, token_data in tokens.items():
+    results = []
+    for variant in variants:
+        render = VARIANTS[variant][0]
         try:
-            # Create QR code
-            qr = qrcode.QRCode(
-                version=1,
-                error_correction=qrcode.constants.ERROR_CORRECT_H,
-                box_size=10,
-                border=4,
-            )
-            
-            qr.add_data(token_id)
-            qr.make(fit=True)
-            
-            # Create QR image (convert to PIL Image if needed)
-            qr_img = qr.make_image(fill_color="black", back_color="white")
-            
-            # Convert to PIL Image if it's not already
-            if hasattr(qr_img, '_img'):
-                qr_img = qr_img._img
-            
-            # Create a larger image with label space
-            width, height = qr_img.size
-            labeled_img = Image.new('RGB', (width, height + 60), 'white')
-            
-            # Paste QR code
-            labeled_img.paste(qr_img, (0, 0))
-            
-            # Add label
-            draw = ImageDraw.Draw(labeled_img)
-            
-            # Try to use a font (fallback to default if not available)
-            try:
-                font = ImageFont.truetype("arial.ttf", 16)
-            except:
-                font = ImageFont.load_default()
-            
-            # Add token ID
-            text = f"ID: {token_id}"
-            draw.text((10, height + 5), text, fill='black', font=font)
-            
-            # Add memory type and group (for GM reference)
-            memory_type = token_data.get('SF_MemoryType', 'Unknown')
-            group = token_data.get('SF_Group', '')[:30]
-            draw.text((10, height + 25), f"Type: {memory_type}", fill='gray', font=font)
-            
-            # Add value rating with stars
-            rating = '⭐' * token_data.get('SF_ValueRating', 0)
-            draw.text((10, height + 45), rating, fill='black', font=font)
-            
-            # Save labeled version
-            output_path = f'qr-codes/{token_id}_labeled.png'
-            labeled_img.save(output_path)
-            print(f'  ✓ Generated {token_id}_labeled.png')
-            generated += 1
-            
+            results.append((variant, render(token_id, token_data, matrix), None))
         except Exception as e:
-            print(f'  ✗ Error generating labeled {token_id}: {e}')
-    
-    print(f"✅ Generated {generated} labeled QR codes")
-    return generated
+            results.append((variant, None, e))
+    return token_id, results
 
-def generate_color_qr():
-    """Generate QR codes with colors based on SF_MemoryType"""
-    os.makedirs('qr-codes', exist_ok=True)
-    
-    # Load tokens - try submodule path first, then root
-    tokens = None
-    try:
-        with open('data/tokens.json', 'r') as f:
-            tokens = json.load(f)
-    except FileNotFoundError:
+def _load_tokens():
+    """Load tokens - try submodule path first, then root; None if missing"""
+    for path in ('data/tokens.json', 'tokens.json'):
         try:
-            with open('tokens.json', 'r') as f:
-                tokens = json.load(f)
+            tokens = load_cached_tokens(path)
         except FileNotFoundError:
-            print("❌ tokens.json not found!")
-            return
+            continue
+        print(f"✅ Loaded tokens from {path}")
+        return tokens
     
-    # Color scheme using RGB tuples
-    colors = {
-        'Personal': (79, 189, 186),      # Teal
-        'Technical': (126, 200, 227),    # Light blue
-        'Mention': (163, 230, 53),       # Lime green
-        'Business': (231, 76, 60),       # Red
-        'Party': (192, 132, 252),        # Purple
-        'Military': (149, 165, 166),     # Gray
-        'Intelligence': (44, 62, 80),    # Dark blue
-        'Test': (136, 136, 136),         # Gray
-        'Classified': (20, 20, 40)       # Very dark blue
-    }
+    print("❌ Error: tokens.json not found!")
+    print("Please ensure tokens.json exists in data/ or current directory")
+    return None
+
+def generate_all(tokens, variants):
+    """Generate every requested QR variant in a single pass over the tokens"""
+    # Create output directory
+    QR_DIR.mkdir(exist_ok=True)
     
-    print("\nGenerating colored QR codes...")
-    generated = 0
+    print("Generating QR codes...")
+    generated = dict.fromkeys(variants, 0)
     
-    for token_id, token_data in tokens.items():
-        try:
-            # Get color for this token's SF_MemoryType
-            memory_type = token_data.get('SF_MemoryType', 'Unknown')
-            color = colors.get(memory_type, (0, 0, 0))  # Default to black
-            
-            # Create QR code
-            qr = qrcode.QRCode(
-                version=1,
-                error_correction=qrcode.constants.ERROR_CORRECT_H,
-                box_size=10,
-                border=4,
-            )
-            
-            qr.add_data(token_id)
-            qr.make(fit=True)
-            
-            # Create image with color
-            img = qr.make_image(fill_color=color, back_color="white")
-            
-            # Save colored version
-            output_path = f'qr-codes/{token_id}_color.png'
-            img.save(output_path)
-            print(f'  ✓ Generated {token_id}_color.png ({memory_type})')
-            generated += 1
-            
-        except Exception as e:
-            print(f'  ✗ Error generating colored {token_id}: {e}')
+    # Collect progress lines and write them in one go after the loop - in a
+    # finally, so lines already collected are still shown if the pool fails
+    log = []
+    worker = partial(_gen_token, variants=variants)
+    try:
+        for token_id, results in _run_parallel(worker, tokens.items()):
+            for variant, name, err in results:
+                if err:
+                    log.append(f'  ✗ Error generating {VARIANTS[variant][1]}{token_id}: {err}')
+                else:
+                    log.append(f'  ✓ Generated {name}')
+                    generated[variant] += 1
+    finally:
+        if log:
+            sys.stdout.write('\n'.join(log) + '\n')
     
-    print(f"✅ Generated {generated} colored QR codes")
+    print()
+    for variant in variants:
+        print(f"✅ Generated {generated[variant]} {VARIANTS[variant][2]}")
     return generated
 
 def main():
@@ -215,16 +204,15 @@ def main():
     print("=" * 60)
     print()
     
-    # Check if tokens.json exists (try submodule path first)
-    if not os.path.exists('data/tokens.json') and not os.path.exists('tokens.json'):
-        print("❌ Error: tokens.json not found!")
-        print("Please ensure tokens.json exists in data/ or current directory")
+    tokens = _load_tokens()
+    if tokens is None:
         return
     
-    # Generate simple QR codes (these are required)
-    count = generate_simple_qr()
+    # Simple QR codes are required; ask for extras up front so every
+    # variant is written in one pass
+    variants = ['simple']
     
-    if count > 0:
+    if tokens:
         print()
         print("Optional: Generate enhanced versions?")
         print("1. Labeled QR codes (with ID and metadata)")
@@ -235,15 +223,15 @@ def main():
         try:
             choice = input("\nChoice (1-4, default=4): ").strip() or "4"
             
-            if choice == "1":
-                generate_labeled_qr()
-            elif choice == "2":
-                generate_color_qr()
-            elif choice == "3":
-                generate_labeled_qr()
-                generate_color_qr()
+            if choice in ("1", "3"):
+                variants.append('labeled')
+            if choice in ("2", "3"):
+                variants.append('color')
         except KeyboardInterrupt:
             print("\nSkipping optional versions")
+        print()
+    
+    generate_all(tokens, variants)
     
     print()
     print("=" * 60)
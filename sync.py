@@ -5,18 +5,22 @@ Syncs token changes from/to shared repository and regenerates QR codes
 """
 
 import subprocess
-import json
 import os
 import sys
 import qrcode
+from multiprocessing import Pool
 from pathlib import Path
 from datetime import datetime
 
+from aln_common import QR_MASK_PATTERN, load_cached_tokens, render_qr
+
+QR_DIR = Path('qr-codes')
+
 def run_command(cmd, description, capture=False):
-    """Run a shell command and return output if requested"""
+    """Run a command (argv list, no shell) and return output if requested"""
     print(f"📌 {description}...")
     try:
-        result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
+        result = subprocess.run(cmd, capture_output=True, text=True)
         if result.returncode != 0 and "nothing to commit" not in result.stdout:
             print(f"  ⚠️  {result.stderr.strip() or result.stdout.strip()}")
             return result.stdout if capture else False
@@ -29,8 +33,8 @@ def sync_submodule():
     """Bidirectional sync with the shared token repository"""
     if not os.path.exists('data/.git'):
         print("⚠️  No git submodule found, initializing...")
-        run_command("git submodule init", "Initializing submodule")
-        run_command("git submodule update", "Getting initial data")
+        run_command(["git", "submodule", "init"], "Initializing submodule")
+        run_command(["git", "submodule", "update"], "Getting initial data")
         return
     
     # Save current directory
@@ -40,32 +44,32 @@ def sync_submodule():
         os.chdir('data')
         
         # Check if we have local changes
-        status = run_command("git status --porcelain", "Checking for local changes", capture=True)
+        status = run_command(["git", "status", "--porcelain"], "Checking for local changes", capture=True)
         has_local_changes = bool(status.strip())
         
         if has_local_changes:
             print("  📝 Found local changes to tokens")
-            # Commit local changes
-            run_command("git add tokens.json", "Staging token changes")
+            # Commit local changes (a pathspec commit stages and commits in one call)
             timestamp = datetime.now().strftime("%Y-%m-%d %H:%M")
-            run_command(f'git commit -m "Update tokens - {timestamp}"', "Committing changes")
+            run_command(["git", "commit", "-m", f"Update tokens - {timestamp}", "--", "tokens.json"],
+                        "Committing token changes")
             
             # Push to shared repo
-            push_result = run_command("git push origin HEAD:main", "Pushing to shared repository")
+            push_result = run_command(["git", "push", "origin", "HEAD:main"], "Pushing to shared repository")
             if push_result:
                 print("  ✅ Pushed local changes to shared repo")
             else:
                 print("  ⚠️  Could not push (may need to pull first)")
         
         # Pull latest changes
-        run_command("git pull origin main --rebase", "Pulling latest from shared repo")
+        run_command(["git", "pull", "origin", "main", "--rebase"], "Pulling latest from shared repo")
         
     finally:
         os.chdir(original_dir)
     
     # Update the parent repo's reference to the submodule
-    run_command("git add data", "Updating submodule reference")
-    run_command('git commit -m "Update submodule reference"', "Committing submodule update")
+    run_command(["git", "commit", "-m", "Update submodule reference", "--", "data"],
+                "Committing submodule update")
 
 def load_tokens():
     """Load tokens from submodule or fallback location"""
@@ -74,53 +78,71 @@ def load_tokens():
     for path in paths:
         if os.path.exists(path):
             print(f"📄 Loading tokens from {path}")
-            with open(path, 'r') as f:
-                return json.load(f), path
+            return load_cached_tokens(path), path
     
     print("❌ No tokens.json found!")
     return None, None
 
+def _gen_one(token_id):
+    """Pool worker: encode one token ID and write its PNG"""
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_H,
+        box_size=10,
+        border=4,
+        mask_pattern=QR_MASK_PATTERN,
+    )
+    qr.add_data(token_id)
+    qr.make(fit=True)
+    
+    img = render_qr(qr)
+    # Write via a temp file: existing PNGs are never regenerated, so a
+    # half-written one left by an interrupted sync would stick forever
+    qr_file = QR_DIR / f"{token_id}.png"
+    tmp_file = qr_file.with_name(qr_file.name + '.tmp')
+    with tmp_file.open('wb') as fp:
+        img.save(fp, format='PNG', compress_level=1, optimize=False)
+    os.replace(tmp_file, qr_file)
+    return token_id
+
 def generate_qr_codes(tokens):
     """Generate QR codes for all tokens"""
-    qr_dir = Path('qr-codes')
-    qr_dir.mkdir(exist_ok=True)
+    QR_DIR.mkdir(exist_ok=True)
     
     # Check existing QR codes
-    existing = set(f.stem for f in qr_dir.glob('*.png'))
+    existing = set(f.stem for f in QR_DIR.glob('*.png'))
     needed = set(tokens.keys())
     
     new_tokens = needed - existing
     removed_tokens = existing - needed
     updated = 0
     
-    # Clean up removed tokens
-    for token_id in removed_tokens:
-        qr_file = qr_dir / f"{token_id}.png"
-        qr_file.unlink()
-        print(f"  🗑️  Removed {token_id}.png")
-    
-    # Generate QR codes
-    for token_id in tokens.keys():
-        qr_file = qr_dir / f"{token_id}.png"
-        
-        # Create QR code
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_H,
-            box_size=10,
-            border=4,
-        )
-        qr.add_data(token_id)
-        qr.make(fit=True)
+    # Collect progress lines and write them in one go at the end - in a
+    # finally, so deletions are still reported if encoding fails
+    log = []
+    try:
+        # Clean up removed tokens
+        for token_id in removed_tokens:
+            qr_file = QR_DIR / f"{token_id}.png"
+            qr_file.unlink()
+            log.append(f"  🗑️  Removed {token_id}.png")
         
-        # Save (overwrites existing)
-        img = qr.make_image(fill_color="black", back_color="white")
-        img.save(qr_file)
+        # Generate QR codes - only for new tokens. The QR payload is the token ID
+        # itself, which is also the filename, so an existing PNG is already current
+        to_encode = [token_id for token_id in tokens.keys() if token_id in new_tokens]
         
-        if token_id in new_tokens:
-            print(f"  ✨ Created {token_id}.png")
-            updated += 1
-        # Silent update for existing tokens
+        # Encode on every core; a steady-state sync has nothing to encode and
+        # never pays for starting the pool
+        if to_encode:
+            workers = min(len(to_encode), os.cpu_count() or 1)
+            chunksize = max(1, len(to_encode) // (4 * workers))
+            with Pool(processes=workers) as pool:
+                for token_id in pool.imap_unordered(_gen_one, to_encode, chunksize=chunksize):
+                    log.append(f"  ✨ Created {token_id}.png")
+                    updated += 1
+    finally:
+        if log:
+            sys.stdout.write("\n".join(log) + "\n")
     
     if updated == 0 and len(removed_tokens) == 0:
         print("  ✅ QR codes are up to date")
@@ -132,26 +154,26 @@ def deploy_to_github_pages():
     print("🚀 Deploying to GitHub Pages...")
     
     # Check for changes
-    status = run_command("git status --porcelain", "Checking for changes to deploy", capture=True)
+    status = run_command(["git", "status", "--porcelain"], "Checking for changes to deploy", capture=True)
     if not status.strip():
         print("  ✅ No changes to deploy")
         return True
     
     # Stage all changes
-    run_command("git add -A", "Staging all changes")
+    run_command(["git", "add", "-A"], "Staging all changes")
     
     # Commit
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M")
     commit_msg = f"🔄 Sync tokens and QR codes - {timestamp}"
-    run_command(f'git commit -m "{commit_msg}"', "Committing changes")
+    run_command(["git", "commit", "-m", commit_msg], "Committing changes")
     
     # Push to GitHub
-    if run_command("git push origin main", "Pushing to GitHub Pages"):
+    if run_command(["git", "push", "origin", "main"], "Pushing to GitHub Pages"):
         print("  ✅ Deployed successfully!")
         print("  🌐 Changes will be live in ~1-2 minutes")
         
         # Try to detect GitHub Pages URL
-        remote_url = run_command("git remote get-url origin", "Getting repo URL", capture=True)
+        remote_url = run_command(["git", "remote", "get-url", "origin"], "Getting repo URL", capture=True)
         if "github.com" in remote_url:
             # Extract username and repo from URL
             import re